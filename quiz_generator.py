@@ -3,55 +3,137 @@ import os
 import json
 import time 
 import random 
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PyPDF2 import PdfReader
 from typing import List, Dict, Any
-from io import BytesIO
+from io import BytesIO, StringIO
 
 try:
-    from transformers import pipeline
+    import orjson
 except ImportError:
-    def pipeline(task, model):
-        print(f"WARNING: Hugging Face 'transformers' library not found. Using stub for {model}.")
-        return lambda x: [{"generated_text": "Could not generate content. Install 'transformers' and 'torch'."}]
+    orjson = None
 
-def get_qa_pipeline():
-    """Loads and caches the Hugging Face QA pipeline."""
+# regex patterns used on the hot paths, compiled once at import
+# generic extraction cleanup
+_WS_RE = re.compile(r'\s+')
+_SHORT_TOKEN_RE = re.compile(r'\b[A-Za-z0-9]\b')
+_DOTS_RE = re.compile(r'\.{2,}')
+_COMMAS_RE = re.compile(r',{2,}')
+# sentence boundary for chunking: whitespace following ., ? or !
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.?!])\s+')
+# characters ignored when comparing questions for duplicates
+_NORMALIZE_Q_RE = re.compile(r'[^\w\s]')
+
+def _stub_pipeline(task, model, **kwargs):
+    print(f"WARNING: Hugging Face 'transformers' library not found. Using stub for {model}.")
+    stub_output = {"generated_text": "Could not generate content. Install 'transformers' and 'torch'."}
+    return lambda x, **kwargs: [stub_output for _ in x] if isinstance(x, list) else [stub_output]
+
+MODEL_NAME = "facebook/bart-large-cnn"
+
+def _load_quantized_model(torch):
+    """Loads the model and tokenizer with the Linear layers dynamically quantized to int8 (CPU only)."""
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, AutoTokenizer.from_pretrained(MODEL_NAME)
+
+def load_pipeline():
+    """Loads the Hugging Face QA pipeline. Not cached: use get_qa_pipeline() or cache the result."""
     # Using a model that performs well for question generation
     # Other options: 't5-small' or 'valhalla/t5-small-qg' (if available)
+    # transformers (and torch) are imported on first use so that importing this module,
+    # e.g. in the PDF extraction worker processes, stays cheap
+    try:
+        from transformers import pipeline
+    except ImportError:
+        pipeline = _stub_pipeline
+
+    model = MODEL_NAME
+    pipeline_kwargs = {}
+    try:
+        import torch
+        if torch.cuda.is_available():
+            # half-precision weights on GPU halve the memory traffic per token
+            pipeline_kwargs = {"device": 0, "torch_dtype": torch.float16}
+        else:
+            # CPU generation is bound by streaming the weights; int8 Linear layers cut those bytes 4x
+            try:
+                model, pipeline_kwargs["tokenizer"] = _load_quantized_model(torch)
+            except Exception as e:
+                print(f"WARNING: int8 quantization unavailable, loading full-precision model: {e}")
+    except ImportError:
+        pass
+
     try:
         return pipeline(
             "text2text-generation", 
-            model="facebook/bart-large-cnn", 
+            model=model, 
             # Load the tokenizer as well
+            **pipeline_kwargs
         )
     except Exception as e:
         print(f"Error loading Hugging Face model: {e}")
         # Return a stub function if model loading fails
         return None 
 
+_QA_PIPELINE = None
+_QA_PIPELINE_LOCK = threading.Lock()
+
+def get_qa_pipeline():
+    """Loads and caches the Hugging Face QA pipeline (loaded once per process)."""
+    global _QA_PIPELINE
+    # only a successfully loaded pipeline is kept, so a failed load is retried on the next call
+    with _QA_PIPELINE_LOCK:
+        if _QA_PIPELINE is None:
+            _QA_PIPELINE = load_pipeline()
+        return _QA_PIPELINE
+
+def preload_qa_pipeline():
+    """Starts loading the process-wide pipeline in a background thread and returns its Future."""
+    # lets callers overlap the model load with text extraction; resolves at once when already loaded
+    loader = ThreadPoolExecutor(max_workers=1)
+    pipeline_future = loader.submit(get_qa_pipeline)
+    loader.shutdown(wait=False)
+    return pipeline_future
+
 #multifile extraction utility functions
 
+def clean_extracted_text(text):
+    """Collapses whitespace, drops single-character tokens and squashes repeated dots/commas."""
+    # the passes stay separate: each one uses a C-level literal replacement, which beats a
+    # single fused pattern that has to call back into Python for every whitespace run
+    cleaned_text = _WS_RE.sub(' ', text).strip()
+    cleaned_text = _SHORT_TOKEN_RE.sub('', cleaned_text).strip()
+    cleaned_text = _DOTS_RE.sub('.', cleaned_text)
+    cleaned_text = _COMMAS_RE.sub(',', cleaned_text)
+    return cleaned_text.strip()
+
+def _extract_page_text(page):
+    """Extracts and cleans the text of a single PDF page."""
+    text = page.extract_text()
+    return clean_extracted_text(text) if text else ""
+
 def extract_text_from_pdf(uploaded_file, selected_pages):
     """Extracts text from selected PDF pages with generic cleaning."""
     if not uploaded_file: return ""
     try:
         uploaded_file.seek(0)
-        reader = PdfReader(uploaded_file)
-        full_text = []
+        reader = PdfReader(uploaded_file, strict=False)
         page_indices = [p - 1 for p in selected_pages if 0 <= p - 1 < len(reader.pages)]
         
-        for page_index in page_indices:
-            page = reader.pages[page_index]
-            text = page.extract_text()
-            if text: full_text.append(text)
+        # pages are extracted and cleaned one at a time, so only one page's raw text is alive
+        page_texts = (_extract_page_text(reader.pages[i]) for i in page_indices)
         
-        raw_text = "\n".join(full_text)
-        cleaned_text = re.sub(r'\s+', ' ', raw_text).strip()
-        cleaned_text = re.sub(r'\b[A-Za-z0-9]\b', '', cleaned_text).strip()
-        cleaned_text = re.sub(r'\.{2,}', '.', cleaned_text)
-        cleaned_text = re.sub(r',{2,}', ',', cleaned_text)
+        cleaned_text = StringIO()
+        for text in page_texts:
+            if text:
+                cleaned_text.write(text)
+                cleaned_text.write(' ')
         
-        return cleaned_text.strip()
+        return cleaned_text.getvalue().strip()
         
     except Exception as e:
         print(f"Error during PDF text extraction: {e}")
@@ -68,7 +150,8 @@ def extract_text_from_docx(uploaded_file):
     if not uploaded_file: return ""
     try:
         uploaded_file.seek(0)
-        document = docx_module.Document(BytesIO(uploaded_file.read()))
+        # the upload is already a seekable stream, so it is parsed in place rather than copied
+        document = docx_module.Document(uploaded_file)
         full_text = [paragraph.text for paragraph in document.paragraphs if paragraph.text.strip()]
         return "\n".join(full_text)
     except Exception as e:
@@ -86,7 +169,7 @@ def extract_text_from_pptx(uploaded_file):
     if not uploaded_file: return ""
     try:
         uploaded_file.seek(0)
-        prs = Presentation(BytesIO(uploaded_file.read()))
+        prs = Presentation(uploaded_file)
         full_text = []
         for slide in prs.slides:
             for shape in slide.shapes:
@@ -115,34 +198,45 @@ def chunk_text(text, chunk_size=3000):
     if not text: return []
     
     # Split by major sentence delimiters
-    sentences = re.split(r'(?<=[.?!])\s+', text)
+    sentences = _SENTENCE_SPLIT_RE.split(text)
     
-    current_chunk = ""
+    # sentences are collected in a list and joined once per chunk;
+    # current_length tracks the length of the joined chunk
+    current_chunk = []
+    current_length = 0
     chunks = []
     
     for sentence in sentences:
-        if len(current_chunk) + len(sentence) + 1 > chunk_size and current_chunk:
-            chunks.append(current_chunk.strip())
-            current_chunk = sentence + "." 
-        else:
-            current_chunk += (" " if current_chunk else "") + sentence
+        if not sentence:
+            continue
+        if current_chunk and current_length + len(sentence) + 1 > chunk_size:
+            chunks.append(" ".join(current_chunk).strip())
+            current_chunk = []
+            current_length = 0
+        
+        current_length += len(sentence) + (1 if current_chunk else 0)
+        current_chunk.append(sentence)
             
     if current_chunk:
-        chunks.append(current_chunk.strip())
+        chunks.append(" ".join(current_chunk).strip())
         
     return chunks
 
-def generate_questions_with_hf(text_chunk: str, num_questions: int) -> List[Dict[str, Any]]:
-    """
-    Uses the Hugging Face model to generate structured MCQ questions from a text chunk.
-    This function is designed to run multiple times across different chunks.
-    """
-    qa_pipeline = get_qa_pipeline()
-    if not qa_pipeline:
-        return []
+# raw model output keyed by (model, chunk digest, question count); oldest entries are evicted first
+_RESPONSE_CACHE: Dict[tuple, str] = {}
+_RESPONSE_CACHE_LOCK = threading.Lock()
+_RESPONSE_CACHE_SIZE = 512
 
-    quiz_data = []
-    
+GENERATION_KWARGS = {
+    "max_length": 1500,
+    "do_sample": True,
+    "top_k": 50,
+    "temperature": 0.7,
+    "num_return_sequences": 1,
+}
+
+def build_prompt(text_chunk: str, num_questions: int) -> str:
+    """Builds the full generation prompt for a single text chunk."""
     #prompt for the model
     system_prompt = (
         "You are an expert quiz generator. Analyze the text provided below and generate a list of "
@@ -155,30 +249,37 @@ def generate_questions_with_hf(text_chunk: str, num_questions: int) -> List[Dict
     
     user_prompt = f"Source Text: \"{text_chunk[:2500]}...\""
     
-    full_prompt = system_prompt + "\n\n" + user_prompt
+    return system_prompt + "\n\n" + user_prompt
+
+def _load_json(json_str: str):
+    """Decodes JSON with orjson when it is installed, falling back to the stdlib parser."""
+    if orjson is not None:
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than json: it rejects NaN/Infinity and lone surrogate escapes,
+            # which would otherwise drop the chunk's questions. the retry only runs on output
+            # that has already failed once, and is tiny next to the generation that produced it
+            pass
+    return json.loads(json_str)
+
+def parse_response(raw_text: str, text_chunk: str) -> List[Dict[str, Any]]:
+    """Parses the model output for one chunk into structured quiz items."""
+    quiz_data = []
     
     try:
-        generated_response = qa_pipeline(
-            full_prompt, 
-            max_length=1500,
-            do_sample=True,
-            top_k=50,
-            temperature=0.7,
-            num_return_sequences=1
-        )
-        
-        raw_text = generated_response[0]['generated_text']
-        
         # Try to clean the output to isolate the pure JSON array
-        # This handles cases where the model wraps the JSON in markdown or plain text
-        json_match = re.search(r'\[.*\]', raw_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
+        # This handles cases where the model wraps the JSON in markdown or plain text:
+        # the array spans from the first '[' to the last ']'
+        start = raw_text.find('[')
+        end = raw_text.rfind(']')
+        if start != -1 and end > start:
+            json_str = raw_text[start:end + 1]
             
-            #basic JSON cleanup 
+            #basic JSON cleanup (raw newlines inside strings are invalid JSON)
             json_str = json_str.replace('\n', ' ').replace('\\n', ' ').strip()
             
-            quiz_list = json.loads(json_str)
+            quiz_list = _load_json(json_str)
             
             for item in quiz_list:
                 options = [item['correct_answer']] + item['distractors']
@@ -193,10 +294,96 @@ def generate_questions_with_hf(text_chunk: str, num_questions: int) -> List[Dict
     except json.JSONDecodeError as e:
         print(f"JSON Decoding Error (Model did not output valid JSON): {e}")
     except Exception as e:
-        print(f"An unexpected error occurred during generation: {e}")
+        print(f"An unexpected error occurred while parsing the model output: {e}")
         
     return quiz_data
 
+def _generated_text(output) -> str:
+    """Returns the generated text from a single pipeline result."""
+    # a result is either a dict or a list holding one dict per returned sequence
+    if isinstance(output, list):
+        output = output[0]
+    return output['generated_text']
+
+def _response_cache_key(text_chunk: str, num_questions: int) -> tuple:
+    """Builds the response cache key for a chunk."""
+    chunk_hash = hashlib.blake2b(text_chunk.encode(), digest_size=16).hexdigest()
+    return (MODEL_NAME, chunk_hash, num_questions)
+
+def _store_response(key: tuple, raw_text: str):
+    """Stores a model response, evicting the oldest entry once the cache is full."""
+    # the cache is shared by every session thread
+    with _RESPONSE_CACHE_LOCK:
+        if len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.pop(next(iter(_RESPONSE_CACHE)), None)
+        _RESPONSE_CACHE[key] = raw_text
+
+def _run_prompts(qa_pipeline, prompts: List[str]) -> list:
+    """
+    Runs the prompts through the pipeline in one batched call.
+    If the batch fails (e.g. out of memory), retries each prompt on its own so one
+    bad chunk does not lose the others; failed prompts yield None.
+    """
+    try:
+        return qa_pipeline(
+            prompts,
+            batch_size=min(8, len(prompts)),
+            **GENERATION_KWARGS
+        )
+    except Exception as e:
+        print(f"Batched generation failed, retrying chunk by chunk: {e}")
+
+    outputs = []
+    for prompt in prompts:
+        try:
+            outputs.append(qa_pipeline(prompt, **GENERATION_KWARGS))
+        except Exception as e:
+            print(f"An unexpected error occurred during generation: {e}")
+            outputs.append(None)
+    return outputs
+
+def generate_questions_batch(text_chunks: List[str], num_questions: int, qa_pipeline=None, use_cache=True) -> List[Dict[str, Any]]:
+    """
+    Generates MCQ questions for several text chunks with a single batched pipeline call.
+    The pipeline micro-batches the prompts internally instead of running one forward pass per chunk.
+    Chunks seen before are served from the response cache and skip the model entirely;
+    use_cache=False samples fresh questions for every chunk (the new responses are still cached).
+    Uses the process-wide cached pipeline unless one is passed in.
+    """
+    if not text_chunks:
+        return []
+
+    cache_keys = [_response_cache_key(chunk, num_questions) for chunk in text_chunks]
+    raw_texts = [_RESPONSE_CACHE.get(key) if use_cache else None for key in cache_keys]
+    missing = [i for i, raw_text in enumerate(raw_texts) if raw_text is None]
+
+    if missing and qa_pipeline is None:
+        qa_pipeline = get_qa_pipeline()
+    if missing and qa_pipeline:
+        prompts = [build_prompt(text_chunks[i], num_questions) for i in missing]
+        
+        for i, output in zip(missing, _run_prompts(qa_pipeline, prompts)):
+            if output is not None:
+                raw_texts[i] = _generated_text(output)
+
+    quiz_data = []
+    for i, (chunk, raw_text) in enumerate(zip(text_chunks, raw_texts)):
+        if raw_text is None:
+            continue
+        chunk_questions = parse_response(raw_text, chunk)
+        # generation is sampled, so an unusable response is not cached and the next run can retry it
+        if chunk_questions and i in missing:
+            _store_response(cache_keys[i], raw_text)
+        quiz_data.extend(chunk_questions)
+        
+    return quiz_data
+
+def generate_questions_with_hf(text_chunk: str, num_questions: int) -> List[Dict[str, Any]]:
+    """
+    Uses the Hugging Face model to generate structured MCQ questions from a text chunk.
+    """
+    return generate_questions_batch([text_chunk], num_questions)
+
 
 #post-processing and deduplication
 
@@ -209,9 +396,13 @@ def post_process_quiz_data(quiz_data: List[Dict[str, Any]], target_count: int) -
     final_questions = []
 
     for item in quiz_data:
+        # stop before normalizing anything once enough questions are collected
+        if len(final_questions) >= target_count:
+            break
+        
         question_text = item.get('question', '').strip()
         
-        normalized_q = re.sub(r'[^\w\s]', '', question_text).lower()
+        normalized_q = _NORMALIZE_Q_RE.sub('', question_text).lower()
         
         if normalized_q in seen_questions:
             continue
@@ -226,20 +417,25 @@ def post_process_quiz_data(quiz_data: List[Dict[str, Any]], target_count: int) -
                 
         # final collection
         final_questions.append(item)
-        
-        if len(final_questions) >= target_count:
-            break
             
     return final_questions
 
 #main orchestration function
 
-def run_question_generation(uploaded_file, selected_pages, difficulty, num_questions, q_type, mcq_type, file_type):
+def run_question_generation(uploaded_file, selected_pages, difficulty, num_questions, q_type, mcq_type, file_type, qa_pipeline=None, text_content=None, use_cache=True):
     """
     Main orchestration function: uses Hugging Face model for generation.
+    qa_pipeline lets callers inject an already loaded pipeline (e.g. one cached by the web app),
+    and text_content already extracted document text, in which case uploaded_file is not read.
+    use_cache=False skips cached model responses so a regeneration gets new questions.
     """
+    # without an injected pipeline, start loading the model so it overlaps with text extraction
+    if qa_pipeline is None:
+        pipeline_future = preload_qa_pipeline()
+
     #extraction and generic cleaning
-    text_content = get_text_content(uploaded_file, selected_pages, file_type)
+    if text_content is None:
+        text_content = get_text_content(uploaded_file, selected_pages, file_type)
     
     if not text_content:
         return []
@@ -247,17 +443,17 @@ def run_question_generation(uploaded_file, selected_pages, difficulty, num_quest
     #chunking
     chunks = chunk_text(text_content, chunk_size=3000)
     
-    all_quiz_data = []
-    
     # we generate a total pool of questions slightly larger than requested (e.g., 1.5x) to account for potential duplicates or invalid JSON outputs.
     
     # distributing the generation request across all chunks
     target_generation_per_chunk = (num_questions * 2 + len(chunks) - 1) // len(chunks) if chunks else num_questions
     
-    for chunk in chunks:
-        # calling the HF model generation function
-        quiz_data_chunk = generate_questions_with_hf(chunk, target_generation_per_chunk)
-        all_quiz_data.extend(quiz_data_chunk)
+    # wait for the background load so the pipeline is not loaded a second time
+    if qa_pipeline is None:
+        qa_pipeline = pipeline_future.result()
+
+    # calling the HF model generation function once for all chunks
+    all_quiz_data = generate_questions_batch(chunks, target_generation_per_chunk, qa_pipeline, use_cache)
         
     #post-processing/deduplication
     final_data = post_process_quiz_data(all_quiz_data, num_questions)
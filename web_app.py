@@ -6,6 +6,9 @@ import io
 
 st.set_page_config(page_title="PDF2Quiz", layout="wide", page_icon="🧠")
 
+# Timer options offered in Practice Mode, in seconds (None means untimed)
+TIMER_SECONDS = {"No Timer": None, "5 Minutes": 300, "10 Minutes": 600}
+
 # --- INITIALIZATION ---
 if "page" not in st.session_state:
     st.session_state.page = "home"
@@ -16,6 +19,16 @@ if "uploaded_file" not in st.session_state:
 if "total_pages" not in st.session_state:
     st.session_state.total_pages = 0
 
+if "pdf_fingerprint" not in st.session_state:
+    st.session_state.pdf_fingerprint = None # (name, size) of the PDF whose page count is stored
+
+if "last_generation_key" not in st.session_state:
+    st.session_state.last_generation_key = None # (file, pages, settings) of the last quiz generated in this session
+
+if "all_pages" not in st.session_state:
+    st.session_state.all_pages = [] # Page numbers offered by the page selector, reused across reruns
+    st.session_state.all_pages_key = None # (file name, page count) the list was built for
+
 if "selected_pages" not in st.session_state:
     st.session_state.selected_pages = []
 
@@ -25,61 +38,103 @@ if "current_question" not in st.session_state:
 if "quiz_data" not in st.session_state:
     st.session_state.quiz_data = []
 
+if "correct_answers" not in st.session_state:
+    st.session_state.correct_answers = [] # Correct answer for each question index, parallel to quiz_data
+
 if "score" not in st.session_state:
     st.session_state.score = 0
 
 if "answers" not in st.session_state:
-    st.session_state.answers = {} # Stores user's selected answer for each question index
+    st.session_state.answers = [] # Stores user's selected answer for each question index (None if unanswered)
+
+if "percentage" not in st.session_state:
+    st.session_state.percentage = 0 # Final score in percent, computed once when the quiz ends
+    st.session_state.badge = "" # Award shown on the results page for that percentage
+    st.session_state.show_balloons = False # Celebrate a top score once, not on every results page rerun
 
 if "feedback" not in st.session_state:
     st.session_state.feedback = ""
 
-if "time_start" not in st.session_state:
-    st.session_state.time_start = None
+if "time_end" not in st.session_state:
+    st.session_state.time_end = None # Absolute deadline (time.time()) of a timed Practice quiz
 
 if "timer_running" not in st.session_state:
     st.session_state.timer_running = False
 
 # --- UTILITY FUNCTIONS ---
 
-@st.cache_data(show_spinner=False)
-def get_pdf_page_count(uploaded_file):
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_pdf_page_count(pdf_bytes):
     """Reads the uploaded PDF file to determine the total number of pages."""
     try:
         # Using io.BytesIO to read the uploaded file content in memory
-        pdf_reader = PdfReader(io.BytesIO(uploaded_file.getvalue()))
-        return len(pdf_reader.pages)
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes), strict=False)
+        try:
+            # /Count on the page tree root avoids building every page object
+            return int(pdf_reader.trailer["/Root"]["/Pages"]["/Count"])
+        except (KeyError, TypeError, ValueError):
+            return len(pdf_reader.pages)
     except Exception as e:
         st.error(f"Error reading PDF pages: {e}")
         return 0
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def extract_document_text(file_bytes, selected_pages, file_type):
+    """Extracts and cleans the document text, so regenerating with new settings skips all file parsing."""
+    return quiz_generator.get_text_content(io.BytesIO(file_bytes), list(selected_pages), file_type)
+
+def get_generator(pipeline_future):
+    """Waits for the background model load; the pipeline is loaded once per server process and shared by all sessions."""
+    # quiz_generator keeps only a successful load, so a failed one is retried on the next click
+    qa_pipeline = pipeline_future.result()
+    if qa_pipeline is None:
+        raise RuntimeError("The AI model could not be loaded. Please check the console for errors.")
+    return qa_pipeline
+
 def get_timer_duration(option):
     """Converts timer option string to seconds."""
-    if "5 Minutes" in option: return 300
-    if "10 Minutes" in option: return 600
-    return None
+    return TIMER_SECONDS.get(option)
+
+def _reset_quiz_state():
+    """Clears the per-quiz session state in a single update."""
+    st.session_state.update(
+        quiz_data=[],
+        correct_answers=[],
+        current_question=1,
+        score=0,
+        percentage=0,
+        badge="",
+        show_balloons=False,
+        answers=[],
+        feedback="",
+        time_end=None,
+        timer_running=False,
+    )
 
 def reset_quiz():
     """Resets all session state variables related to the quiz."""
     st.session_state.page = "home"
-    st.session_state.quiz_data = []
-    st.session_state.current_question = 1
-    st.session_state.score = 0
-    st.session_state.answers = {}
-    st.session_state.feedback = ""
-    st.session_state.time_start = None
-    st.session_state.timer_running = False
+    _reset_quiz_state()
+
+def _pick_badge(percentage):
+    """Returns the award badge for a final score percentage."""
+    if percentage >= 90:
+        return "🥇 Gold Star Performance"
+    if percentage >= 70:
+        return "🥈 Silver Badge"
+    if percentage >= 50:
+        return "🥉 Bronze Effort"
+    return "Keep practicing!"
 
 def calculate_final_score():
-    """Calculates the final score based on stored answers."""
-    correct_count = 0
+    """Calculates the final score, percentage and badge based on stored answers."""
+    correct_count = sum(1 for user_answer, correct_answer in zip(st.session_state.answers, st.session_state.correct_answers) if user_answer == correct_answer)
     total_q = len(st.session_state.quiz_data)
-    for i in range(total_q):
-        correct_answer = st.session_state.quiz_data[i]['correct_answer']
-        user_answer = st.session_state.answers.get(i)
-        if user_answer == correct_answer:
-            correct_count += 1
     st.session_state.score = correct_count
+    # Stored once here so the results page is a pure render
+    st.session_state.percentage = (correct_count / total_q) * 100 if total_q > 0 else 0
+    st.session_state.badge = _pick_badge(st.session_state.percentage)
+    st.session_state.show_balloons = st.session_state.percentage >= 90
     return correct_count
 
 # --- CORE FUNCTION TO HANDLE GENERATION ---
@@ -111,41 +166,78 @@ def generate_quiz():
         return
 
     # Reset quiz state before generation
-    st.session_state.quiz_data = []
-    st.session_state.current_question = 1
-    st.session_state.score = 0
-    st.session_state.answers = {}
-    st.session_state.feedback = ""
-    st.session_state.time_start = None
-    st.session_state.timer_running = False
+    _reset_quiz_state()
 
+    # Load the model in the background so it overlaps with text extraction
+    pipeline_future = quiz_generator.preload_qa_pipeline()
 
     with st.spinner(f"Analyzing {file_name} and generating questions..."):
+        
+        text_content = extract_document_text(
+            st.session_state.uploaded_file.getvalue(),
+            tuple(st.session_state.selected_pages),
+            file_type
+        )
+
+        if not text_content:
+            st.error("Could not generate questions. The document may be empty or failed to process.")
+            return
+
+        try:
+            qa_pipeline = get_generator(pipeline_future)
+        except RuntimeError as e:
+            st.error(str(e))
+            return
        
+        # Generating again with the same file and settings asks the model for a fresh set of questions
+        generation_key = (
+            file_name, st.session_state.uploaded_file.size, tuple(st.session_state.selected_pages),
+            st.session_state.num_q, st.session_state.difficulty_q, st.session_state.type_q, st.session_state.mcq_type_q
+        )
+        use_cache = generation_key != st.session_state.last_generation_key
+        st.session_state.last_generation_key = generation_key
+
         quiz_data = quiz_generator.run_question_generation(
             uploaded_file=st.session_state.uploaded_file,
             selected_pages=st.session_state.selected_pages,
             # Config. parameters 
-            difficulty=st.session_state.difficulty, 
-            q_type=st.session_state.question_type, 
-            mcq_type=st.session_state.mcq_type, 
-            num_questions=st.session_state.num_questions,
-            file_type=file_type 
+            # generate_quiz runs as the home page button's callback, so the widget keys are present
+            difficulty=st.session_state.difficulty_q, 
+            q_type=st.session_state.type_q, 
+            mcq_type=st.session_state.mcq_type_q, 
+            num_questions=st.session_state.num_q,
+            file_type=file_type,
+            qa_pipeline=qa_pipeline,
+            text_content=text_content,
+            use_cache=use_cache
         )
 
     if quiz_data:
+        # Freeze the options so st.radio gets the same immutable object on every rerun
+        for q in quiz_data:
+            q['options'] = tuple(q['options'])
         st.session_state.quiz_data = quiz_data
+        st.session_state.correct_answers = [q['correct_answer'] for q in quiz_data]
+        st.session_state.answers = [None] * len(quiz_data)
         st.session_state.page = "quiz" 
         # Timer for Practice Mode
         if st.session_state.mode == "Practice" and st.session_state.timer_option != "No Timer":
-            st.session_state.time_start = time.time()
+            st.session_state.time_end = time.time() + get_timer_duration(st.session_state.timer_option)
             st.session_state.timer_running = True
-            # For the timer to update, we need to rerun the app periodically in the quiz page
+            # The timer fragment on the quiz page counts down to this deadline
     else:
         st.error("Could not generate questions. The document may be empty or failed to process.")
 
-def handle_answer_selection(q_idx, selected_option):
-    """Records the user's answer and provides feedback based on the mode."""
+def handle_answer_selection(q_idx):
+    """
+    Records the user's answer and provides feedback based on the mode.
+    Runs as the answer radio's on_change callback, before the rerun that redraws the page.
+    """
+    selected_option = st.session_state[f"q_radio_{q_idx}"]
+    # Only the first selection for a question is recorded
+    if selected_option is None or st.session_state.answers[q_idx] is not None:
+        return
+
     st.session_state.answers[q_idx] = selected_option
     q_data = st.session_state.quiz_data[q_idx]
     
@@ -167,16 +259,13 @@ def handle_answer_selection(q_idx, selected_option):
         # Practice Mode: No immediate score update, just store the answer
         st.session_state.feedback = "Answer recorded. Click 'Next Question' to continue."
 
-    # Rerun to update the feedback display
-    st.rerun() # <-- FIX APPLIED HERE
-
 def next_question():
     """Moves to the next question or the results page."""
     total_q = len(st.session_state.quiz_data)
     
     # Check if the current question has been answered (essential for Practice Mode logic)
     q_idx = st.session_state.current_question - 1
-    if st.session_state.mode == "Practice" and q_idx not in st.session_state.answers:
+    if st.session_state.mode == "Practice" and st.session_state.answers[q_idx] is None:
         st.warning("Please select an answer before moving to the next question.")
         return
 
@@ -195,40 +284,41 @@ def next_question():
 
 # --- QUIZ PAGE IMPLEMENTATION ---
 
+@st.fragment(run_every=1.0)
+def render_timer():
+    """Displays the Practice Mode countdown. Only this fragment reruns on each tick, not the whole page."""
+    # The deadline is fixed at quiz start, so each tick is a single subtraction and cannot drift
+    remaining_time = max(0.0, st.session_state.time_end - time.time())
+    
+    # Check if time is up
+    if remaining_time == 0:
+        st.session_state.timer_running = False
+        st.session_state.page = "results"
+        calculate_final_score()
+        st.warning("Time's up! Submitting your answers.")
+        time.sleep(1) # Pause for user to see the message
+        st.rerun(scope="app") # Full rerun to leave the quiz page
+    
+    # Display Timer
+    minutes = int(remaining_time // 60)
+    seconds = int(remaining_time % 60)
+    
+    if remaining_time < 60:
+        timer_color = "red"
+    else:
+        timer_color = "green"
+
+    st.markdown(
+        f'<div style="background-color: #f0f2f6; padding: 10px; border-radius: 10px; text-align: center; color: {timer_color}; font-size: 24px; font-weight: bold;">'
+        f'Time Remaining: {minutes:02d}:{seconds:02d}'
+        '</div>', 
+        unsafe_allow_html=True
+    )
+
 def quiz_page():
     # Timer Logic (runs only in Practice Mode)
     if st.session_state.timer_running and st.session_state.mode == "Practice" and st.session_state.timer_option != "No Timer":
-        total_duration = get_timer_duration(st.session_state.timer_option)
-        elapsed_time = time.time() - st.session_state.time_start
-        remaining_time = max(0, total_duration - elapsed_time)
-        
-        # Check if time is up
-        if remaining_time == 0:
-            st.session_state.timer_running = False
-            st.session_state.page = "results"
-            calculate_final_score()
-            st.warning("Time's up! Submitting your answers.")
-            time.sleep(1) # Pause for user to see the message
-            st.rerun() # <-- FIX APPLIED HERE
-        
-        # Display Timer
-        minutes = int(remaining_time // 60)
-        seconds = int(remaining_time % 60)
-        
-        if remaining_time < 60:
-            timer_color = "red"
-        else:
-            timer_color = "green"
-
-        st.markdown(
-            f'<div style="background-color: #f0f2f6; padding: 10px; border-radius: 10px; text-align: center; color: {timer_color}; font-size: 24px; font-weight: bold;">'
-            f'Time Remaining: {minutes:02d}:{seconds:02d}'
-            '</div>', 
-            unsafe_allow_html=True
-        )
-        # Force a rerun every second to update the timer display
-        time.sleep(1)
-        st.rerun() # <-- FIX APPLIED HERE
+        render_timer()
 
 
     # Header and Progress
@@ -255,21 +345,19 @@ def quiz_page():
     # Using st.radio to ensure only one answer is selected and to simplify state management
     
     # --- Option Selection ---
-    user_selection = st.radio(
+    # The answer is recorded by the on_change callback, so a selection costs a single rerun
+    st.radio(
         "Select your answer:",
         options=q_data['options'],
         index=None, # No default selection
-        key=f"q_radio_{q_idx}"
+        key=f"q_radio_{q_idx}",
+        on_change=handle_answer_selection,
+        args=(q_idx,)
     )
-
-    # --- Handle Submission/Answer Recording ---
-    # Only process if a selection is made and it hasn't been recorded yet
-    if user_selection and st.session_state.answers.get(q_idx) is None:
-        handle_answer_selection(q_idx, user_selection)
         
     # --- Display Feedback ---
     # Display recorded answer for Practice Mode, or feedback for Learning Mode
-    if st.session_state.mode == "Practice" and st.session_state.answers.get(q_idx):
+    if st.session_state.mode == "Practice" and st.session_state.answers[q_idx]:
         st.info("Answer selected. Click Next to continue.")
     
     if st.session_state.mode == "Learning" and st.session_state.feedback:
@@ -290,7 +378,7 @@ def quiz_page():
         # Button label changes if it's the last question
         next_label = "Finish Quiz" if current_q_num == total_q else "Next Question >>"
         # Only allow navigation if an answer is selected OR if in Learning mode (where feedback is immediate)
-        if st.session_state.answers.get(q_idx) or st.session_state.mode == "Learning":
+        if st.session_state.answers[q_idx] or st.session_state.mode == "Learning":
             if st.button(next_label, type="primary"):
                 next_question()
         elif st.session_state.mode == "Practice":
@@ -303,7 +391,6 @@ def quiz_page():
 def results_page():
     total_q = len(st.session_state.quiz_data)
     final_score = st.session_state.score
-    percentage = (final_score / total_q) * 100 if total_q > 0 else 0
     
     st.title(" Quiz Results")
     
@@ -313,18 +400,13 @@ def results_page():
         st.markdown("### Final Score")
         st.metric(label="Total Correct", value=f"{final_score} / {total_q}")
         
-        # Award badge based on percentage
-        if percentage >= 90:
+        # Award badge computed when the quiz ended
+        # Balloons fire on the first render only; the review toggle reruns this page
+        if st.session_state.show_balloons:
+            st.session_state.show_balloons = False
             st.balloons()
-            badge = "🥇 Gold Star Performance"
-        elif percentage >= 70:
-            badge = "🥈 Silver Badge"
-        elif percentage >= 50:
-            badge = "🥉 Bronze Effort"
-        else:
-            badge = "Keep practicing!"
         
-        st.info(badge)
+        st.info(st.session_state.badge)
 
         if st.button("Start New Quiz", on_click=reset_quiz, type="primary"):
              pass # Logic handled by reset_quiz
@@ -332,19 +414,29 @@ def results_page():
 
     with col_review:
         st.markdown("### Review Your Answers")
+        expand_all = st.toggle("Expand all questions")
         
         # Review Mode: Show all questions, user answers, and correct answers
+        # Each question is a collapsed expander (the first few open) so long quizzes stay compact
         for i, q_data in enumerate(st.session_state.quiz_data):
-            user_answer = st.session_state.answers.get(i, "No Answer Selected")
+            user_answer = st.session_state.answers[i]
+            if user_answer is None:
+                user_answer = "No Answer Selected"
             is_correct = (user_answer == q_data['correct_answer'])
             
             icon = "✅" if is_correct else "❌"
             
-            st.markdown(f"#### {icon} Q{i+1}: {q_data['question']}")
-            st.markdown(f"**Your Answer:** `{user_answer}`")
-            st.markdown(f"**Correct Answer:** `{q_data['correct_answer']}`")
-            st.markdown(f"**Source Context:** *{q_data['source_snippet']}*")
-            st.markdown("---")
+            question = q_data['question']
+            title = question if len(question) <= 60 else question[:60] + "…"
+            
+            with st.expander(f"{icon} Q{i+1}: {title}", expanded=expand_all or i < 3):
+                # One markdown element per question instead of five
+                st.markdown(
+                    f"**{question}**\n\n"
+                    f"**Your Answer:** `{user_answer}`\n\n"
+                    f"**Correct Answer:** `{q_data['correct_answer']}`\n\n"
+                    f"**Source Context:** *{q_data['source_snippet']}*"
+                )
 
 
 # --- Main Application Flow ---
@@ -369,18 +461,23 @@ if st.session_state.page == "home":
     # Handle page count and selection only for PDFs
     if st.session_state.uploaded_file and st.session_state.uploaded_file.name.lower().endswith('.pdf'):
         # Get and cache the page count only when a new PDF is uploaded
-        current_page_count = get_pdf_page_count(st.session_state.uploaded_file)
-        st.session_state.total_pages = current_page_count
+        pdf_fingerprint = (st.session_state.uploaded_file.name, st.session_state.uploaded_file.size)
+        if st.session_state.pdf_fingerprint != pdf_fingerprint:
+            current_page_count = get_pdf_page_count(st.session_state.uploaded_file.getvalue())
+            st.session_state.total_pages = current_page_count
+            st.session_state.pdf_fingerprint = pdf_fingerprint
     
     # If the file is not a PDF, reset the page count and selection
     elif st.session_state.uploaded_file and not st.session_state.uploaded_file.name.lower().endswith('.pdf'):
         st.session_state.total_pages = 0
         st.session_state.selected_pages = []
+        st.session_state.pdf_fingerprint = None
     
     # Case where file is un-uploaded or session is fresh
     else:
         st.session_state.total_pages = 0
         st.session_state.selected_pages = []
+        st.session_state.pdf_fingerprint = None
 
 
     col1, col2 = st.columns([1, 3])
@@ -389,12 +486,14 @@ if st.session_state.page == "home":
         st.subheader("Quiz Configuration")
 
         # Configuration settings
+        # Only mode and timer_option are copied out of their widget keys: they are read on the quiz page,
+        # where these widgets are not rendered and Streamlit drops their keys
         st.session_state.mode = st.selectbox("Select Mode", ["Learning", "Practice"], key="mode_q")
-        st.session_state.num_questions = st.number_input("Number of Questions", min_value=1, max_value=50, value=10, key="num_q")
-        st.session_state.difficulty = st.selectbox("Difficulty Level", ["Easy", "Medium", "Hard"], key="difficulty_q")
-        st.session_state.question_type = st.selectbox("Question Type", ["Multiple Choice"], key="type_q")
-        st.session_state.mcq_type = st.selectbox("MCQ Type", ["Single Answer"], key="mcq_type_q")
-        st.session_state.timer_option = st.selectbox("Timer Option (Practice Mode)", ["No Timer", "5 Minutes", "10 Minutes"], key="timer_option_q")
+        st.number_input("Number of Questions", min_value=1, max_value=50, value=10, key="num_q")
+        st.selectbox("Difficulty Level", ["Easy", "Medium", "Hard"], key="difficulty_q")
+        st.selectbox("Question Type", ["Multiple Choice"], key="type_q")
+        st.selectbox("MCQ Type", ["Single Answer"], key="mcq_type_q")
+        st.session_state.timer_option = st.selectbox("Timer Option (Practice Mode)", list(TIMER_SECONDS), key="timer_option_q")
 
 
         # ATTACHING THE CALL TO THE BUTTON
@@ -412,7 +511,12 @@ if st.session_state.page == "home":
         # --- PDF PAGE SELECTION LOGIC ---
         if st.session_state.uploaded_file and st.session_state.uploaded_file.name.lower().endswith('.pdf'):
             if st.session_state.total_pages > 0:
-                all_pages = list(range(1, st.session_state.total_pages + 1))
+                # Rebuild the page list only when the PDF changes
+                pages_key = (st.session_state.uploaded_file.name, st.session_state.total_pages)
+                if st.session_state.all_pages_key != pages_key:
+                    st.session_state.all_pages = list(range(1, st.session_state.total_pages + 1))
+                    st.session_state.all_pages_key = pages_key
+                all_pages = st.session_state.all_pages
                 
                 # Update selected_pages with the multiselect widget
                 st.session_state.selected_pages = st.multiselect(